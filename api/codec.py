@@ -0,0 +1,178 @@
+'''
+Copyright 2018 Hyperfine
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Compact storage of raw INTEGER-mode field samples.
+Raw samples are slowly varying int32 counts. Each chunk is stored as its first sample followed by the zigzag encoded
+differences between consecutive samples, either packed in the smallest of 1, 2 or 4 bytes holding all of them, or
+additionally compressed with zlib. Differences are computed modulo 2**32, so any int32 sequence round-trips.
+Chunk layout: header (method, byte width, sample count, first sample) followed by the payload.
+CompressedSamples buffers samples as they are fetched and encodes them by chunks of a fixed size.
+'''
+
+import struct
+import threading
+import zlib
+import numpy as np
+
+DELTA_PACK = 0
+DELTA_ZLIB = 1
+
+_header = struct.Struct('<BBIi')  # method, byte width, sample count, first sample
+_uint_dtypes = {1: '<u1', 2: '<u2', 4: '<u4'}
+
+
+def _zigzag_deltas(samples):
+    '''
+    Differences between consecutive samples (modulo 2**32), mapped to unsigned integers so that small magnitudes
+    give small values.
+    :param samples: int32 samples
+    :return: uint32 array, one element shorter than samples
+    '''
+    deltas = np.diff(samples)
+    return ((deltas << 1) ^ (deltas >> 31)).view(np.uint32)
+
+
+def _undo_zigzag_deltas(zigzag, first):
+    '''
+    Inverse of _zigzag_deltas.
+    The zigzag mapping is undone in the payload's own width, as the differences fit the signed type of that width.
+    :param zigzag: zigzag encoded differences, uint8, uint16 or uint32
+    :param first: first sample of the chunk
+    :return: int32 samples
+    '''
+    one = zigzag.dtype.type(1)
+    deltas = ((zigzag >> one) ^ -(zigzag & one)).view(zigzag.dtype.str.replace('u', 'i'))
+    samples = np.empty(zigzag.size + 1, dtype=np.int32)
+    samples[0] = first
+    samples[1:] = deltas
+    np.add.accumulate(samples, out=samples)  # Wraps modulo 2**32 like the differences
+    return samples
+
+
+def encode_chunk(samples, method=DELTA_PACK):
+    '''
+    Encode a chunk of raw samples.
+    :param samples: iterable of int32 samples
+    :param method: DELTA_PACK or DELTA_ZLIB
+    :return: encoded chunk
+    :rtype: bytes
+    '''
+    if method not in (DELTA_PACK, DELTA_ZLIB):
+        raise ValueError("Unknown encoding method: {}".format(method))
+
+    samples = np.asarray(samples, dtype=np.int32).ravel()
+    if samples.size == 0:
+        return _header.pack(method, 1, 0, 0)
+
+    zigzag = _zigzag_deltas(samples)
+    largest = int(zigzag.max()) if zigzag.size else 0
+    width = 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+
+    payload = zigzag.astype(_uint_dtypes[width]).tobytes()
+    if method == DELTA_ZLIB:
+        payload = zlib.compress(payload, 1)
+
+    return _header.pack(method, width, samples.size, samples[0]) + payload
+
+
+def decode_chunk(chunk):
+    '''
+    Decode a chunk produced by encode_chunk.
+    :param chunk: encoded chunk
+    :type chunk: bytes | bytearray | memoryview
+    :return: samples
+    :rtype: numpy.ndarray of int32
+    '''
+    method, width, n_samples, first = _header.unpack_from(chunk)
+    if n_samples == 0:
+        return np.empty(0, dtype=np.int32)
+
+    if method == DELTA_PACK:
+        payload = chunk[_header.size:]
+    elif method == DELTA_ZLIB:
+        payload = zlib.decompress(chunk[_header.size:])
+    else:
+        raise ValueError("Unknown encoding method: {}".format(method))
+
+    zigzag = np.frombuffer(payload, dtype=_uint_dtypes[width], count=n_samples - 1)
+    return _undo_zigzag_deltas(zigzag, first)
+
+
+def decode_chunks(chunks):
+    '''
+    Decode and concatenate a sequence of chunks.
+    :param chunks: iterable of encoded chunks
+    :return: samples
+    :rtype: numpy.ndarray of int32
+    '''
+    decoded = [decode_chunk(chunk) for chunk in chunks]
+    if not decoded:
+        return np.empty(0, dtype=np.int32)
+    return np.concatenate(decoded)
+
+
+class CompressedSamples():
+    '''
+    Growing sequence of int32 samples, kept as encoded chunks of chunk_size samples.
+    Appended samples are copied into a raw buffer, which is encoded once it is full.
+    append is meant to be called from a single acquisition thread, while other threads read the samples: a full buffer
+    is encoded first, then the chunk is added and the buffer emptied together, so readers never see its samples twice.
+    '''
+
+    def __init__(self, chunk_size=65536, method=DELTA_PACK):
+        self.chunk_size = chunk_size
+        self.method = method
+        self.chunks = []
+
+        self._pending = np.empty(chunk_size, dtype=np.int32)
+        self._n_pending = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.chunks) * self.chunk_size + self._n_pending
+
+    def append(self, samples):
+        '''
+        :param samples: int32 samples, in any byte order
+        '''
+        samples = np.asarray(samples).ravel()
+        start = 0
+        while start < samples.size:
+            n_copied = min(samples.size - start, self.chunk_size - self._n_pending)
+            with self._lock:
+                self._pending[self._n_pending:self._n_pending + n_copied] = samples[start:start + n_copied]
+                self._n_pending += n_copied
+            start += n_copied
+
+            if self._n_pending == self.chunk_size:
+                # Readers only copy _pending, so it can be encoded without holding the lock
+                chunk = encode_chunk(self._pending, self.method)
+                with self._lock:
+                    self.chunks.append(chunk)
+                    self._n_pending = 0
+
+    def samples(self):
+        '''
+        :return: all samples appended so far
+        :rtype: numpy.ndarray of int32
+        '''
+        with self._lock:
+            chunks = list(self.chunks)
+            pending = self._pending[:self._n_pending].copy()
+        return np.concatenate((decode_chunks(chunks), pending))
+
+    def nbytes(self):
+        '''
+        :return: storage used by the encoded chunks and the raw buffer
+        '''
+        with self._lock:
+            return sum(len(chunk) for chunk in self.chunks) + self._pending.nbytes
@@ -0,0 +1,67 @@
+'''
+Copyright 2018 Hyperfine
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Bounded log of the errors read from the THM1176 error queue
+Answers to chained :SYSTEM:ERROR? queries (<code>,"<message>" separated by ';') are parsed in one go. Only the most
+recent entries are kept, with the time they were read, while counts per error code cover the whole session.
+'''
+
+import collections
+import re
+import time
+
+_error_re = re.compile(r'([+-]?\d+),"((?:[^"]|"")*)"')
+
+
+class ErrorLog():
+
+    def __init__(self, max_entries=1000):
+        '''
+        :param max_entries: number of most recent errors kept
+        '''
+        self.entries = collections.deque(maxlen=max_entries)  # (time read, code, message)
+        self.counts = collections.Counter()  # code: number of occurrences
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def add(self, code, message, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.entries.append((timestamp, code, message))
+        self.counts[code] += 1
+
+    def add_answer(self, answer, timestamp=None):
+        '''
+        Log the errors found in the answer to one or more :SYSTEM:ERROR? queries. "No error" (code 0) is skipped.
+        :param answer: e.g. '-113,"Undefined header";0,"No error"'
+        :return: number of errors logged
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        n_errors = 0
+        for code, message in _error_re.findall(answer):
+            code = int(code)
+            if code != 0:
+                self.add(code, message.replace('""', '"'), timestamp)
+                n_errors += 1
+        return n_errors
+
+    def clear(self):
+        self.entries.clear()
+        self.counts.clear()
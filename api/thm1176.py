@@ -0,0 +1,419 @@
+'''
+Copyright 2018 Hyperfine
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+functions
+parse_ieee_block_header
+from_binary_block
+_use_numpy_routines
+are copied from pyVISA library
+copyright: 2014 by PyVISA Authors, see AUTHORS for more details.
+license: MIT, see pyVISA LICENSE for more details.
+Interaction with Metrolab's THM1176 field probe, independent of the communication backend
+All I/O goes through a transport (see api.transports): usbtmc, pyVISA, or an in-process fake instrument.
+Author: Cedric Hugon
+Date: 16Apr2018
+'''
+
+import re
+import struct
+import inspect
+import numpy as np
+from . import codec
+from .error_log import ErrorLog
+
+def _use_numpy_routines(container):
+    """Should optimized numpy routines be used to extract the data.
+    """
+    # Function copied from pyVISA
+    # copyright: 2014 by PyVISA Authors, see AUTHORS for more details.
+    # license: MIT, see pyVISA LICENSE for more details.
+    if np is None or container in (tuple, list):
+        return False
+
+    if (container is np.array or (inspect.isclass(container) and
+                                  issubclass(container, np.ndarray))):
+        return True
+
+    return False
+
+
+def parse_ieee_block_header(block):
+    """
+    Parse the header of a IEEE block.
+    Definite Length Arbitrary Block:
+    #<header_length><data_length><data>
+    The header_length specifies the size of the data_length field.
+    And the data_length field specifies the size of the data.
+    Indefinite Length Arbitrary Block:
+    #0<data>
+    :param block: IEEE block.
+    :type block: bytes | bytearray | memoryview
+    :return: (offset, data_length)
+    :rtype: (int, int)
+    """
+    # Function copied from pyVISA
+    # copyright: 2014 by PyVISA Authors, see AUTHORS for more details.
+    # license: MIT, see pyVISA LICENSE for more details.
+
+
+    # re instead of block.find, as memoryview has no find
+    hash_sign = re.search(b'#', block)
+    begin = hash_sign.start() if hash_sign else -1
+    if begin < 0:
+        raise ValueError("Could not find hash sign (#) indicating the start of"
+                         " the block.")
+
+    try:
+        # int(block[begin+1]) != int(block[begin+1:begin+2]) in Python 3
+        header_length = int(bytes(block[begin + 1:begin + 2]))
+    except ValueError:
+        header_length = 0
+    offset = begin + 2 + header_length
+
+    if header_length > 0:
+        # #3100DATA
+        # 012345
+        data_length = int(bytes(block[begin + 2:offset]))
+    else:
+        # #0DATA
+        # 012
+        data_length = len(block) - offset - 1
+
+    return offset, data_length
+
+
+def from_binary_block(block, offset=0, data_length=None, datatype='f',
+                      is_big_endian=False, container=list):
+    """
+    Convert a binary block into an iterable of numbers.
+    :param block: binary block.
+    :type block: bytes | bytearray | memoryview
+    :param offset: offset at which the data block starts (default=0)
+    :param data_length: size in bytes of the data block
+                        (default=len(block) - offset)
+    :param datatype: the format string for a single element. See struct module.
+    :param is_big_endian: boolean indicating endianess.
+    :param container: container type to use for the output data.
+    :return: items
+    :rtype: type(container)
+    """
+    # Function copied from pyVISA
+    # copyright: 2014 by PyVISA Authors, see AUTHORS for more details.
+    # license: MIT, see pyVISA LICENSE for more details.
+
+    if data_length is None:
+        data_length = len(block) - offset
+
+    element_length = struct.calcsize(datatype)
+    array_length = int(data_length / element_length)
+
+    endianess = '>' if is_big_endian else '<'
+
+    if _use_numpy_routines(container):
+        return np.frombuffer(block, endianess + datatype, array_length, offset)
+
+    fullfmt = '%s%d%s' % (endianess, array_length, datatype)
+
+    try:
+        return container(struct.unpack_from(fullfmt, block, offset))
+    except struct.error:
+        raise ValueError("Binary data was malformed")
+
+
+class Thm1176():
+    ranges = ["0.1T", '0.3T', '1T', '3T']  # HF ["0.1T", '0.5T', '3T', '20T'] MF ["0.1T", '0.3T', '1T', '3T']
+    trigger_period_bounds = (122e-6, 2.79)
+    base_fetch_cmd = ':FETCh:ARRay:'
+    axes = ['X', 'Y', 'Z']
+    field_axes = ['Bx', 'By', 'Bz']
+    fetch_kinds = ['Bx', 'By', 'Bz', 'Timestamp',
+                   'Temperature']  # Order matters, this is linked to the fetch command that is sent to retrived data
+    n_digits = 5
+    defaults = {'block_size': 10, 'period': 0.5, 'range': '0.1T', 'average': 1, 'format': 'INTEGER'}
+    id_fields = ['manufacturer', 'model', 'serial', 'version']
+    error_batch_size = 8  # Errors read per transaction when draining the error queue
+
+    def __init__(self, transport, **kwargs):
+        '''
+        :param transport: transport used to talk to the probe, see api.transports
+        :param kwargs: settings, see setup
+        '''
+        self.transport = transport
+
+        self.running = False
+        self.stop = False
+
+        self.fetch_cmd = None
+        self.fetch_error_cmd = None  # Fetch command also draining the error queue, used while error_pending
+
+        self.read_buffer = None  # Reusable receive buffer for binary fetches, sized from block_size in setup
+
+        self.block_size = self.defaults['block_size']
+        self.period = self.defaults['period']
+        self.range = self.defaults['range']
+        self.average = self.defaults['average']
+        self.format = self.defaults['format']
+
+        self.last_reading = {fetch_kind: None for fetch_kind in self.fetch_kinds}
+        self.data_stack = {fetch_kind: [] for fetch_kind in self.fetch_kinds}
+        self.errors = ErrorLog()
+        self.error_pending = False
+
+        # When compress is set, INTEGER field samples are stored in compressed_stack instead of in data_stack.
+        # Only raw INTEGER samples can be compressed, setup refuses compress with the ASCII format.
+        self.compress = False
+        self.compressed_stack = {field_axis: codec.CompressedSamples() for field_axis in self.field_axes}
+
+        self.setup(**kwargs)
+
+    def allocate_read_buffer(self):
+        '''
+        Allocate the reusable buffer binary fetches are received into.
+        It is sized for the INTEGER answer to the fetch command built from block_size.
+        :return:
+        '''
+        # 4B/sample for each axis, plus IEEE block headers, separators, time, temperature and status,
+        # plus up to 256B for each error read by fetch_error_cmd
+        size = self.block_size * len(self.axes) * 4 + 128 + self.error_batch_size * 256
+        if self.read_buffer is None or len(self.read_buffer) < size:
+            self.read_buffer = bytearray(size)
+
+    def set_format(self):
+        self.transport.write(':FORMAT:DATA ' + self.format)
+
+    def set_average(self):
+
+        self.transport.write(':AVERAGE:COUNT {}'.format(self.average))
+
+    def set_range(self):
+        '''
+        Set sense range of the Metrolab THM1176
+        Possible ranges are 0.1T,0.3T,1T,3T
+        :param range_str:
+        :return:
+        '''
+
+        self.transport.write(':SENSe:FLUX:RANGe ' + self.range)
+
+    def set_periodic_trigger(self):
+        '''
+        Set the probe to run in periodic trigger mode with a given period, continuously
+        :param period:
+        :return:
+        '''
+        if self.trigger_period_bounds[0] <= self.period <= self.trigger_period_bounds[1]:
+            self.transport.write(':TRIGger:SOURce TIMer')
+            self.transport.write(':TRIGger:TIMer {:f}S'.format(self.period))
+            self.transport.write(':TRIG:COUNT {}'.format(self.block_size))
+            self.transport.write(':INIT:CONTINUOUS ON')
+            return True
+        else:
+            print('Invalid trigger period value.')
+            return False
+
+    def str_conv(self, input_str, kind):
+        if kind == 'Timestamp':
+            val = int(input_str, 0) * 1e-9
+            time_offset = val - (self.block_size - 1) * self.period
+            res = np.linspace(time_offset, val, self.block_size)
+        elif kind == 'Temperature':
+            res = int(input_str) * np.ones(self.block_size)
+
+        else:
+            res = np.fromstring(input_str.replace('T', ''), sep=',')
+
+        return res
+
+    def parse_ascii_responses(self, kind, res_in):
+        '''
+        :param kind:
+        :return:
+        '''
+        if kind == 'fetch':
+            parsed = res_in.split(';')
+
+            for idx, key in enumerate(self.fetch_kinds):
+                self.last_reading[key] = self.str_conv(parsed[idx], key)
+
+            n_kinds = len(self.fetch_kinds)
+            self.log_errors(';'.join(parsed[n_kinds:-1]), parsed[-1])
+
+    def parse_binary_responses(self, kind, res_in, n_bytes=None):
+        '''
+        Field arrays in last_reading are views into res_in, they are only valid until res_in is refilled.
+        :param kind:
+        :param res_in: raw answer (bytes, or reusable bytearray)
+        :param n_bytes: number of valid bytes in res_in (default=len(res_in))
+        :return:
+        '''
+        if kind == 'fetch':
+            res_in = memoryview(res_in)[:n_bytes]  # Stale bytes past n_bytes must not count in block lengths
+            glob_offset = 0
+
+            for idx, key in enumerate(self.fetch_kinds[:3]):
+                offset, length = parse_ieee_block_header(res_in)
+                glob_offset += offset
+                self.last_reading[key] = from_binary_block(res_in, offset=glob_offset, data_length=length,
+                                                           datatype='i', is_big_endian=True, container=np.array)
+                glob_offset += length + 4
+
+            glob_offset -= 3  # separation between last binary block and timestamp string is only one byte isntead of 4
+            parsed = bytes(res_in[glob_offset:]).split(b';')
+            for idx, key in enumerate(self.fetch_kinds[3:]):
+                self.last_reading[key] = self.str_conv(parsed[idx].decode('ascii'), key)
+
+            ending = parsed[-1].decode('ascii')
+            n_kinds = len(self.fetch_kinds[3:])
+            self.log_errors(b';'.join(parsed[n_kinds:-1]).decode('ascii'), ending.split('\n')[0])
+
+    def log_errors(self, errors_answer, status):
+        '''
+        Log the errors read along with a fetch, and flag whether the error queue still needs draining.
+        While error_pending is set, the next fetches also read error_batch_size errors, instead of querying the
+        error queue in separate transactions.
+        :param errors_answer: answer to the :SYSTEM:ERROR? queries, empty if none were sent
+        :param status: status byte, bit 2 is set while the error queue is not empty
+        :return: number of errors logged
+        '''
+        n_errors = self.errors.add_answer(errors_answer) if errors_answer else 0
+        self.error_pending = bool(int(status) & 4)
+        return n_errors
+
+    def get_id(self):
+        '''
+        Get the identification string of the instrument.
+        Parse it according to expected format specified by docs.
+        :return:
+        '''
+        self.transport.write('*IDN?')
+        res = self.transport.read()
+        id_vals = res.split(',')
+        header = {field: val for field, val in zip(self.id_fields, id_vals)}
+
+        return header
+
+    def get_data_array(self):
+        '''
+        Fetch data from probe buffer
+        :return:
+        '''
+        if self.running:
+
+            fetch_cmd = self.fetch_error_cmd if self.error_pending else self.fetch_cmd
+
+            if self.format == 'ASCII':
+                res = self.transport.query(fetch_cmd)
+                self.parse_ascii_responses('fetch', res)
+
+            elif self.format == 'INTEGER':
+
+                self.transport.write(fetch_cmd)
+                n_bytes = self.transport.read_into(self.read_buffer)
+                self.parse_binary_responses('fetch', self.read_buffer, n_bytes)
+
+    def setup(self, **kwargs):
+        '''
+        :param kwargs:
+        :return:
+        '''
+        keys = kwargs.keys()
+
+        if 'block_size' in keys:
+            self.block_size = kwargs['block_size']
+
+        if 'period' in keys:
+            if self.trigger_period_bounds[0] <= kwargs['period'] <= self.trigger_period_bounds[1]:
+                self.period = kwargs['period']
+            else:
+                print('Invalid trigger period value.')
+                print('Setting to default...')
+                self.period = self.defaults['period']
+
+        if 'range' in keys:
+            if kwargs['range'] in self.ranges:
+                self.range = kwargs['range']
+
+        if 'average' in keys:
+            self.average = kwargs['average']
+
+        if 'format' in keys:
+            self.format = kwargs['format']
+
+        if 'compress' in keys:
+            self.compress = kwargs['compress']
+
+        if self.compress and self.format != 'INTEGER':
+            print('Compression is only available with INTEGER format.')
+            print('Field samples will be stored uncompressed...')
+            self.compress = False
+
+        self.allocate_read_buffer()
+
+        self.set_format()
+        self.set_range()
+        self.set_average()
+        self.set_periodic_trigger()
+
+        cmd = ''
+        for axis in self.axes:
+            cmd += self.base_fetch_cmd + axis + '? {},{};'.format(self.block_size, self.n_digits)
+        cmd += ':FETCH:TIMESTAMP?;:FETCH:TEMPERATURE?;'
+        self.fetch_cmd = cmd + '*STB?'
+        self.fetch_error_cmd = cmd + ':SYSTEM:ERROR?;' * self.error_batch_size + '*STB?'
+
+    def start_acquisition(self):
+
+        self.running = True
+        self.stop = False
+        self.transport.write(':INIT')
+        while not self.stop:
+            self.get_data_array()
+
+            if self.compress and self.format == 'INTEGER':
+                for key in self.field_axes:
+                    self.compressed_stack[key].append(self.last_reading[key])
+                stacked_kinds = self.fetch_kinds[3:]
+            else:
+                stacked_kinds = self.fetch_kinds
+
+            self.data_stack = {key: np.hstack((self.data_stack[key], self.last_reading[key]))
+                               if key in stacked_kinds else self.data_stack[key] for key in self.fetch_kinds}
+
+        self.stop_acquisition()
+        self.running = False
+
+    def get_field_samples(self, key):
+        '''
+        Decode the raw samples stored in compressed_stack for one field axis.
+        :param key: one of field_axes
+        :return: int32 samples
+        '''
+        return self.compressed_stack[key].samples()
+
+    def stop_acquisition(self):
+
+        res = self.transport.query(':ABORT;*STB?')
+        print("Stopping acquisition...")
+        print("THM1176 status: {}".format(res))
+
+    def check_error(self):
+        '''
+        Drain the error queue into errors, error_batch_size errors per transaction.
+        :return: number of errors logged
+        '''
+        cmd = ':SYSTEM:ERROR?;' * self.error_batch_size + '*STB?'
+        n_errors = 0
+        while True:
+            errors_answer, status = self.transport.query(cmd).rsplit(';', 1)
+            n_logged = self.log_errors(errors_answer, status)
+            n_errors += n_logged
+            if not self.error_pending or n_logged == 0:
+                return n_errors
\ No newline at end of file
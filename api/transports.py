@@ -0,0 +1,266 @@
+'''
+Copyright 2018 Hyperfine
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Transports used by api.thm1176.Thm1176 to talk to the THM1176 probe.
+A transport only moves commands and answers: write a command, read a text answer, query (write then read),
+and read a raw answer into a preallocated buffer.
+UsbtmcTransport wraps a usbtmc.Instrument (libusb driver), VisaTransport an opened pyVISA resource,
+FakeTransport is an in-process instrument producing synthetic answers, used to run the api without hardware.
+'''
+
+import array
+import ctypes
+import re
+import struct
+import numpy as np
+
+try:
+    import usb.core
+except ImportError:
+    usb = None
+
+try:
+    from pyvisa import constants
+except ImportError:
+    constants = None
+
+USBTMC_HEADER_SIZE = 12
+MAX_TRANSFER_SIZE = 49216  # (4096 samples * 3 axes * 4B/sample + 64B for time&temp&...
+
+
+class Transport():
+    '''
+    Interface expected by Thm1176.
+    '''
+
+    def write(self, cmd):
+        raise NotImplementedError
+
+    def read(self):
+        '''
+        :return: text answer, without termination character
+        '''
+        raise NotImplementedError
+
+    def query(self, cmd):
+        self.write(cmd)
+        return self.read()
+
+    def read_into(self, buffer):
+        '''
+        Read a complete raw answer into a preallocated buffer.
+        :param buffer: writable buffer (bytearray) large enough to hold the whole answer
+        :return: number of bytes written to buffer
+        '''
+        raise NotImplementedError
+
+
+class UsbtmcTransport(Transport):
+
+    def __init__(self, instrument):
+        '''
+        :param instrument: usbtmc.Instrument
+        '''
+        self.instrument = instrument
+        self.instrument.max_transfer_size = MAX_TRANSFER_SIZE
+        self.instrument.timeout = 10
+
+        self._transfer_buffer = array.array('B', bytes(MAX_TRANSFER_SIZE + USBTMC_HEADER_SIZE + 3))
+
+    def write(self, cmd):
+        self.instrument.write(cmd)
+
+    def read(self):
+        return self.instrument.read()
+
+    def query(self, cmd):
+        return self.instrument.ask(cmd)
+
+    def read_into(self, buffer):
+        '''
+        Same transfer logic as usbtmc.Instrument.read_raw, but transfers are received in a reusable array and only
+        their payload is copied into the buffer.
+        As in read_raw, a failed or timed out transfer aborts the bulk-IN transfer before the error is raised again,
+        so that no partial answer is left for the next read. The same is done when the buffer is full before the
+        end of the answer.
+        '''
+        instrument = self.instrument
+        if not instrument.connected:
+            instrument.open()
+
+        view = memoryview(buffer)
+        transfer_view = memoryview(self._transfer_buffer)
+        n_bytes = 0
+        eom = False
+
+        try:
+            while not eom:
+                read_len = min(instrument.max_transfer_size, len(view) - n_bytes)
+                if read_len <= 0:
+                    instrument._abort_bulk_in()
+                    raise ValueError("Read buffer too small for instrument response")
+
+                req = instrument.pack_dev_dep_msg_in_header(read_len, instrument.term_char)
+                instrument.bulk_out_ep.write(req)
+                count = instrument.bulk_in_ep.read(self._transfer_buffer, timeout=int(instrument.timeout * 1000))
+
+                # USBTMC header: MsgID, bTag, bTagInverse, reserved, TransferSize, bmTransferAttributes, 3 reserved
+                transfer_size, transfer_attributes = struct.unpack_from('<4xIB', self._transfer_buffer)
+                transfer_size = min(transfer_size, count - USBTMC_HEADER_SIZE)
+                payload = transfer_view[USBTMC_HEADER_SIZE:USBTMC_HEADER_SIZE + transfer_size]
+                view[n_bytes:n_bytes + transfer_size] = payload
+                n_bytes += transfer_size
+                eom = transfer_attributes & 1
+        except usb.core.USBError:
+            instrument._abort_bulk_in()
+            raise
+
+        return n_bytes
+
+
+class VisaTransport(Transport):
+
+    def __init__(self, visa_res):
+        '''
+        :param visa_res: opened visa resource
+        '''
+        self.visa_res = visa_res
+        self.visa_res.read_termination = '\n'
+        self.visa_res.chunk_size = MAX_TRANSFER_SIZE
+        self.visa_res.timeout = 10000
+
+    def write(self, cmd):
+        self.visa_res.write(cmd)
+
+    def read(self):
+        return self.visa_res.read()
+
+    def query(self, cmd):
+        return self.visa_res.query(cmd)
+
+    def read_into(self, buffer):
+        '''
+        Same loop as the resource's _read_raw. With the ctypes VISA library, viRead writes straight into the buffer;
+        other backends (e.g. pyvisa-py) only allow reading chunks, which are then copied into the buffer.
+        '''
+        view = memoryview(buffer)
+        session = self.visa_res.session
+        visalib = self.visa_res.visalib
+        vi_read = getattr(getattr(visalib, 'lib', None), 'viRead', None)
+        return_count = ctypes.c_uint32()
+        n_bytes = 0
+
+        status = constants.StatusCode.success_max_count_read
+        with self.visa_res.ignore_warning(constants.VI_SUCCESS_DEV_NPRESENT, constants.VI_SUCCESS_MAX_CNT):
+            while status == constants.StatusCode.success_max_count_read:
+                size = min(self.visa_res.chunk_size, len(view) - n_bytes)
+                if size <= 0:
+                    self.visa_res.clear()  # Discard the rest of the answer, so the next read does not get it
+                    raise ValueError("Read buffer too small for instrument response")
+
+                if vi_read is not None:
+                    chunk = (ctypes.c_ubyte * size).from_buffer(buffer, n_bytes)
+                    status = vi_read(session, chunk, size, ctypes.byref(return_count))
+                    count = return_count.value
+                else:
+                    chunk, status = visalib.read(session, size)
+                    count = len(chunk)
+                    view[n_bytes:n_bytes + count] = chunk
+                n_bytes += count
+
+        return n_bytes
+
+
+class FakeTransport(Transport):
+    '''
+    In-process THM1176 answering the commands sent by Thm1176 with synthetic data.
+    Field samples are a slow random walk around a few hundred counts (INTEGER) or microtesla (ASCII).
+    Errors put in error_queue are reported through the status byte and :SYSTEM:ERROR? like the probe does.
+    '''
+    id_string = 'Metrolab Technology SA,THM1176-MF,0000000,fake'
+    temperature = 32000
+    field_block_separator = b';\n\n\n'  # 4 bytes between consecutive field blocks, see Thm1176.parse_binary_responses
+
+    def __init__(self, seed=0):
+        self.format = 'INTEGER'
+        self.block_size = 10
+        self.period = 0.5
+        self.timestamp = 0  # ns
+        self.error_queue = []
+
+        self._rng = np.random.RandomState(seed)
+        self._field_state = np.array([200, -150, 400], dtype=np.int64)
+        self._answer = b''
+
+    def _fetch_answer(self, block_size, queries):
+        '''
+        :param block_size: samples per axis
+        :param queries: queries following the fetch of field, timestamp and temperature, e.g. ['*STB?']
+        '''
+        steps = self._rng.randint(-3, 4, size=(3, block_size))
+        fields = self._field_state[:, None] + np.cumsum(steps, axis=1)
+        self._field_state = fields[:, -1]
+        self.timestamp += int(block_size * self.period * 1e9)
+        tail = ';{:#x};{};'.format(self.timestamp, self.temperature)
+        tail += ';'.join(self._query_answer(query) for query in queries) + '\n'
+
+        if self.format == 'ASCII':
+            answer = ';'.join(','.join('{:.5e}T'.format(val * 1e-6) for val in axis) for axis in fields)
+            return (answer + tail).encode('ascii')
+
+        data_length = str(block_size * 4).encode('ascii')
+        header = b'#' + str(len(data_length)).encode('ascii') + data_length
+        blocks = [header + axis.astype('>i4').tobytes() for axis in fields]
+        answer = self.field_block_separator.join(blocks)
+        return answer + tail.encode('ascii')
+
+    def _query_answer(self, cmd):
+        if cmd == '*IDN?':
+            return self.id_string
+        if cmd == '*STB?':
+            return '4' if self.error_queue else '0'
+        if cmd.startswith(':SYSTEM:ERROR'):
+            return self.error_queue.pop(0) if self.error_queue else '0,"No error"'
+        return None
+
+    def write(self, cmd):
+        if cmd.startswith(':FETCh:ARRay:'):
+            block_size = int(re.search(r'\? (\d+),', cmd).group(1))
+            self._answer = self._fetch_answer(block_size, cmd.split(';')[5:])
+            return
+
+        answers = []
+        for part in cmd.split(';'):
+            if part.startswith(':FORMAT:DATA '):
+                self.format = part.split(' ')[1]
+            elif part.startswith(':TRIG:COUNT '):
+                self.block_size = int(part.split(' ')[1])
+            elif part.startswith(':TRIGger:TIMer '):
+                self.period = float(part.split(' ')[1].rstrip('S'))
+            else:
+                answer = self._query_answer(part)
+                if answer is not None:
+                    answers.append(answer)
+
+        self._answer = (';'.join(answers) + '\n').encode('ascii') if answers else b''
+
+    def read(self):
+        answer = self._answer.decode('ascii')
+        self._answer = b''
+        return answer.rstrip('\n')
+
+    def read_into(self, buffer):
+        n_bytes = len(self._answer)
+        if n_bytes > len(buffer):
+            raise ValueError("Read buffer too small for instrument response")
+        buffer[:n_bytes] = self._answer
+        self._answer = b''
+        return n_bytes
@@ -0,0 +1,281 @@
+'''
+Copyright 2018 Hyperfine
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Benchmarks of the THM1176 api, running without hardware against api.transports.FakeTransport
+Covers block parsing, ASCII and INTEGER fetch parsing, str_conv, data_stack accumulation and the full acquisition
+loop, for block sizes from 1 to 4096 samples. Reports samples/s, us per fetch and peak memory (tracemalloc), and
+compares against a saved baseline.
+Usage:
+    python benchmarks/bench_thm.py --save-baseline       # record benchmarks/baseline.json
+    python benchmarks/bench_thm.py                       # compare, exit status 1 on regression
+The baseline records --fetches, --repeat and --block-sizes; comparing with a different --fetches is refused.
+'''
+
+import sys
+import os
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(CURRENT_DIR))
+
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+import numpy as np
+
+from api import thm1176
+from api.transports import FakeTransport
+
+BLOCK_SIZES = [1, 16, 256, 4096]
+DEFAULT_BASELINE = os.path.join(CURRENT_DIR, 'baseline.json')
+
+
+class CountingThm1176(thm1176.Thm1176):
+    '''
+    Thm1176 stopping start_acquisition after a given number of fetches.
+    With fetch=False, get_data_array keeps the current last_reading, so only the data_stack accumulation is measured.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.n_fetches = 0
+        self.fetch = True
+        self.fetch_count = 0
+        super().__init__(*args, **kwargs)
+
+    def get_data_array(self):
+        if self.fetch:
+            super().get_data_array()
+        self.fetch_count += 1
+        if self.fetch_count >= self.n_fetches:
+            self.stop = True
+
+
+def make_thm(block_size, fmt):
+    thm = CountingThm1176(FakeTransport(), block_size=block_size, period=0.01, format=fmt)
+    thm.running = True
+    return thm
+
+
+def fetch_answer(thm):
+    '''
+    One synthetic answer to the fetch command, as received from the probe.
+    '''
+    if thm.format == 'ASCII':
+        return thm.transport.query(thm.fetch_cmd)
+    thm.transport.write(thm.fetch_cmd)
+    n_bytes = thm.transport.read_into(thm.read_buffer)
+    return bytes(thm.read_buffer[:n_bytes])
+
+
+def bench_ieee_block(block_size, n_fetches):
+    answer = fetch_answer(make_thm(block_size, 'INTEGER'))
+
+    def run():
+        for _ in range(n_fetches):
+            offset, length = thm1176.parse_ieee_block_header(answer)
+            thm1176.from_binary_block(answer, offset=offset, data_length=length, datatype='i', is_big_endian=True,
+                                      container=np.array)
+
+    return run
+
+
+def bench_parse_ascii(block_size, n_fetches):
+    thm = make_thm(block_size, 'ASCII')
+    answer = fetch_answer(thm)
+
+    def run():
+        for _ in range(n_fetches):
+            thm.parse_ascii_responses('fetch', answer)
+
+    return run
+
+
+def bench_parse_binary(block_size, n_fetches):
+    thm = make_thm(block_size, 'INTEGER')
+    answer = fetch_answer(thm)
+    thm.read_buffer[:len(answer)] = answer
+
+    def run():
+        for _ in range(n_fetches):
+            thm.parse_binary_responses('fetch', thm.read_buffer, len(answer))
+
+    return run
+
+
+def bench_str_conv(block_size, n_fetches):
+    thm = make_thm(block_size, 'ASCII')
+    parsed = fetch_answer(thm).split(';')
+
+    def run():
+        for _ in range(n_fetches):
+            for idx, key in enumerate(thm.fetch_kinds):
+                thm.str_conv(parsed[idx], key)
+
+    return run
+
+
+def bench_data_stack(block_size, n_fetches):
+    thm = make_thm(block_size, 'INTEGER')
+    thm.get_data_array()
+    thm.fetch = False
+
+    def run():
+        thm.data_stack = {key: [] for key in thm.fetch_kinds}
+        thm.n_fetches = n_fetches
+        thm.fetch_count = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            thm.start_acquisition()
+
+    return run
+
+
+def bench_acquisition(fmt):
+
+    def bench(block_size, n_fetches):
+        thm = make_thm(block_size, fmt)
+
+        def run():
+            thm.data_stack = {key: [] for key in thm.fetch_kinds}
+            thm.n_fetches = n_fetches
+            thm.fetch_count = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                thm.start_acquisition()
+
+        return run
+
+    return bench
+
+
+BENCHMARKS = [
+    ('ieee_block', bench_ieee_block),
+    ('parse_ascii', bench_parse_ascii),
+    ('parse_binary', bench_parse_binary),
+    ('str_conv', bench_str_conv),
+    ('data_stack', bench_data_stack),
+    ('acquisition_ascii', bench_acquisition('ASCII')),
+    ('acquisition_integer', bench_acquisition('INTEGER')),
+]
+
+
+def measure(bench, block_size, n_fetches, repeat):
+    '''
+    Best time out of repeat runs, then peak memory of one more run.
+    :return: result dict
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        run = bench(block_size, n_fetches)
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    run = bench(block_size, n_fetches)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'samples_per_s': block_size * n_fetches / best,
+            'us_per_fetch': best / n_fetches * 1e6,
+            'peak_kb': peak / 1024}
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Compare time per fetch and peak memory of each case against the baseline.
+    :return: names of the cases slower, or using more memory, than baseline by more than tolerance
+    '''
+    regressions = []
+    print('{:32s} {:>12s} {:>12s}'.format('benchmark', 'time', 'peak memory'))
+    for name, res in sorted(results.items()):
+        if name not in baseline:
+            continue
+        time_ratio = res['us_per_fetch'] / baseline[name]['us_per_fetch']
+        memory_ratio = res['peak_kb'] / baseline[name]['peak_kb']
+        flags = []
+        if time_ratio > 1 + tolerance:
+            flags.append('TIME')
+        # Peaks of a few hundred bytes vary with interpreter internals, ignore changes below 1 kB
+        if memory_ratio > 1 + tolerance and res['peak_kb'] - baseline[name]['peak_kb'] > 1:
+            flags.append('MEMORY')
+        if flags:
+            regressions.append(name)
+        print('{:32s} {:11.2f}x {:11.2f}x{}'.format(name, time_ratio, memory_ratio,
+                                                  '  REGRESSION ({})'.format(', '.join(flags)) if flags else ''))
+    return regressions
+
+
+def check_params(params, baseline_params):
+    '''
+    Results depend on the number of fetches per run (data_stack grows with every fetch), so a baseline recorded with
+    other parameters cannot be compared against.
+    :return: False if the baseline cannot be used
+    '''
+    if baseline_params is None:
+        print('Baseline has no run parameters, record it again with --save-baseline')
+        return False
+    if params['fetches'] != baseline_params['fetches']:
+        print('Baseline was recorded with --fetches {}, run with the same value to compare'.format(
+            baseline_params['fetches']))
+        return False
+    if params['repeat'] != baseline_params['repeat']:
+        print('Warning: baseline was recorded with --repeat {}'.format(baseline_params['repeat']))
+    missing = set(params['block_sizes']) - set(baseline_params['block_sizes'])
+    if missing:
+        print('Warning: no baseline for block sizes {}'.format(sorted(missing)))
+    return True
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='THM1176 api benchmarks, without hardware')
+    parser.add_argument('--fetches', type=int, default=200, help='fetches per run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the best one is kept')
+    parser.add_argument('--block-sizes', type=int, nargs='+', default=BLOCK_SIZES)
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='save results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative increase of time or memory before reporting a regression')
+    args = parser.parse_args()
+    params = {'fetches': args.fetches, 'repeat': args.repeat, 'block_sizes': args.block_sizes}
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not check_params(params, baseline.get('params')):
+            sys.exit(2)
+
+    results = {}
+    print('{:32s} {:>14s} {:>12s} {:>12s}'.format('benchmark', 'samples/s', 'us/fetch', 'peak kB'))
+    for name, bench in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        for block_size in args.block_sizes:
+            case = '{}[{}]'.format(name, block_size)
+            res = measure(bench, block_size, args.fetches, args.repeat)
+            results[case] = res
+            print('{:32s} {:14.0f} {:12.2f} {:12.1f}'.format(case, res['samples_per_s'], res['us_per_fetch'],
+                                                             res['peak_kb']))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.baseline))
+    elif baseline is not None:
+        print()
+        if compare(results, baseline['results'], args.tolerance):
+            sys.exit(1)
+    else:
+        print('No baseline at {}, run with --save-baseline to create one'.format(args.baseline))
@@ -0,0 +1,117 @@
+'''
+Copyright 2018 Hyperfine
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+Round-trip tests of the raw sample codec
+'''
+
+import sys
+import os
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(CURRENT_DIR))
+
+import threading
+import unittest
+import numpy as np
+
+from api import codec
+
+INT32_MIN = np.iinfo(np.int32).min
+INT32_MAX = np.iinfo(np.int32).max
+METHODS = [codec.DELTA_PACK, codec.DELTA_ZLIB]
+
+
+class TestCodec(unittest.TestCase):
+
+    def assert_round_trip(self, samples):
+        samples = np.asarray(samples, dtype=np.int32)
+        for method in METHODS:
+            decoded = codec.decode_chunk(codec.encode_chunk(samples, method))
+            self.assertEqual(decoded.dtype, np.int32)
+            np.testing.assert_array_equal(decoded, samples)
+
+    def test_empty(self):
+        self.assert_round_trip([])
+
+    def test_one_sample(self):
+        self.assert_round_trip([INT32_MIN])
+        self.assert_round_trip([123])
+
+    def test_int32_swings(self):
+        self.assert_round_trip([INT32_MAX, INT32_MIN, 0, INT32_MAX, INT32_MIN, INT32_MIN, -1, INT32_MAX])
+
+    def test_widths(self):
+        rng = np.random.RandomState(0)
+        for step in [1, 100, 30000, 2 ** 20]:
+            self.assert_round_trip(np.cumsum(rng.randint(-step, step + 1, size=1000)))
+
+    def test_slowly_varying_is_compact(self):
+        samples = 200 + np.cumsum(np.random.RandomState(0).randint(-3, 4, size=4096))
+        for method in METHODS:
+            self.assertLessEqual(len(codec.encode_chunk(samples, method)), samples.size + 10)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            codec.encode_chunk([1, 2], method=42)
+
+    def test_decode_chunks(self):
+        samples = np.arange(-50, 50, dtype=np.int32)
+        chunks = [codec.encode_chunk(samples[:30]), codec.encode_chunk(samples[30:], codec.DELTA_ZLIB)]
+        np.testing.assert_array_equal(codec.decode_chunks(chunks), samples)
+        self.assertEqual(codec.decode_chunks([]).size, 0)
+
+
+class TestCompressedSamples(unittest.TestCase):
+
+    def test_append_across_chunks(self):
+        samples = np.cumsum(np.random.RandomState(1).randint(-5, 6, size=1000)).astype(np.int32)
+        store = codec.CompressedSamples(chunk_size=64)
+        for block in np.array_split(samples, 37):
+            store.append(block.astype('>i4'))  # Fetched INTEGER samples are big-endian
+
+        self.assertEqual(len(store), samples.size)
+        self.assertEqual(len(store.chunks), samples.size // 64)
+        np.testing.assert_array_equal(store.samples(), samples)
+
+    def test_empty(self):
+        self.assertEqual(codec.CompressedSamples().samples().size, 0)
+
+    def test_read_at_chunk_boundary(self):
+        store = codec.CompressedSamples(chunk_size=4)
+        store.append(np.arange(3, dtype=np.int32))
+        seen = []
+
+        def read():
+            seen.append((len(store), store.samples()))
+
+        reader = threading.Thread(target=read)
+
+        class Chunks(list):
+
+            def append(self, chunk):
+                # Read from another thread right after the full buffer is stored as a chunk
+                super().append(chunk)
+                reader.start()
+                reader.join(0.2)
+
+        store.chunks = Chunks()
+        store.append(np.arange(3, 5, dtype=np.int32))
+        reader.join()
+        read()
+
+        self.assertEqual(len(seen), 2)
+        for n_samples, samples in seen:
+            self.assertEqual(n_samples, samples.size)
+            np.testing.assert_array_equal(samples, np.arange(samples.size))
+
+
+if __name__ == '__main__':
+    unittest.main()